@@ -1,26 +1,28 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import collections
+import functools
+import random
+import re
 from collections import abc
-from ipaddress import IPv4Address, IPv6Address
+from ipaddress import IPv4Address, IPv6Address, ip_address
 from http import HTTPStatus
 import warnings
-import logging
 from typing import Optional, Sequence, Set, List, Dict, Any, Union, Type, Iterable, AsyncIterable
 from types import TracebackType
 
-from pydantic import BaseModel, Field, ValidationError, validator
 import aiohttp
 import aiohttp.helpers
 import yarl
-import aioitertools
-import tenacity
 
 from aioipapi._logging import logger
 from aioipapi import _constants as constants
-from aioipapi._config import config
-from aioipapi._utils import chunker
-from aioipapi._exceptions import ClientError, HttpError, TooManyRequests, TooLargeBatchSize, AuthError
+from aioipapi._config import Config, config as default_config
+from aioipapi._ratelimit import TokenBucket, RateLimitWindow
+from aioipapi._session import acquire_session, release_session
+from aioipapi._utils import chunker, json_dumpb, json_loads
+from aioipapi._exceptions import ClientError, HttpError, TooManyRequests, TooLargeBatchSize, AuthError, _RateLimited
 
 
 _IPType = Union[str, IPv4Address, IPv6Address]
@@ -29,61 +31,91 @@ _IPsType = Union[Iterable[_QueryType], AsyncIterable[_QueryType]]
 _FieldsType = Optional[Union[Sequence[str], Set[str]]]
 _TimeoutType = Union[aiohttp.ClientTimeout, int, float, object]
 
+_SCALAR_IP_TYPES = (str, IPv4Address, IPv6Address)
+_SEQ_TYPES = frozenset({list, tuple, set, frozenset})
 
-class _IpAddr(BaseModel):
-    """IP address validation model
-    """
+_SUPPORTED_FIELDS = constants.FIELDS | constants.SERVICE_FIELDS
+_QUERY_KEYS = frozenset({'query', 'fields', 'lang'})
 
-    v: Union[IPv4Address, IPv6Address]
+_JSON_HEADERS = {aiohttp.hdrs.CONTENT_TYPE: 'application/json'}
 
+_IPV4_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_IPV4_RE = re.compile(rf'(?:{_IPV4_OCTET}\.){{3}}{_IPV4_OCTET}')
+
+
+def _check_fields(fields) -> None:
+    unsupported_fields = set(fields) - _SUPPORTED_FIELDS
+    if unsupported_fields:
+        raise ValueError(f"Unsupported fields: {unsupported_fields}. Supported fields: {_SUPPORTED_FIELDS}")
+
+
+def _check_lang(lang: str) -> None:
+    if lang not in constants.LANGS:
+        raise ValueError(f"Unsupported lang '{lang}'. Supported languages: {constants.LANGS}")
+
+
+def _check_fields_lang(fields, lang) -> None:
+    # The invalid values are rejected before they consume the rate limit
+    if fields:
+        _check_fields(fields)
+    if lang:
+        _check_lang(lang)
+
+
+def _fields_param(fields) -> str:
+    return ','.join(sorted(set(fields) | constants.SERVICE_FIELDS))
+
+
+def _is_fields_type(fields) -> bool:
+    # The concrete type lookup avoids the slow abc.Sequence/abc.Set subclass hooks in the common case
+    return type(fields) in _SEQ_TYPES or (not isinstance(fields, str) and isinstance(fields, (abc.Sequence, abc.Set)))
+
+
+def _is_iterable(obj) -> bool:
+    # Direct attribute checks are much cheaper than isinstance checks with abc.Iterable/abc.AsyncIterable
+    return hasattr(obj, '__iter__') or hasattr(obj, '__aiter__')
 
-class _Fields(BaseModel):
-    """Fields validation model
-    """
 
-    v: Union[Sequence[str], Set[str]]
+def _validate_ip(ip) -> str:
+    ip = str(ip)
+    if _IPV4_RE.fullmatch(ip):
+        return ip
+    try:
+        ip_address(ip)
+    except ValueError as err:
+        raise ValueError(f"IP address '{ip}' is invalid: {err}") from err
+    return ip
 
 
-class _QueryInfo(BaseModel):
-    """Validation model for IPs query with additional info
+def _validate_query(ip) -> Union[str, Dict[str, str]]:
+    """Validates a batch query item and returns it in the form to send to the service
     """
 
-    query: str
-    fields_: Optional[str] = Field(alias='fields')
-    lang: Optional[str]
+    if type(ip) is not dict and (isinstance(ip, _SCALAR_IP_TYPES) or not isinstance(ip, abc.Mapping)):
+        return _validate_ip(ip)
 
-    class Config:
-        extra = 'forbid'
+    if not ip.keys() <= _QUERY_KEYS:
+        raise ValueError(f"Unknown query keys: {set(ip.keys()) - _QUERY_KEYS}")
+    if 'query' not in ip:
+        raise ValueError("'query' key is required")
 
-    @validator('query', pre=True)
-    def query_validator(cls, v):
-        try:
-            _IpAddr(v=v)
-        except ValidationError as err:
-            raise ValueError(f"IP address '{v}' is invalid: {err}") from err
-        return str(v)
+    query = {'query': _validate_ip(ip['query'])}
 
-    @validator('fields_', pre=True)
-    def fields_validator(cls, v):
-        try:
-            _Fields(v=v)
-        except ValidationError:
+    fields = ip.get('fields')
+    if fields is not None:
+        if not _is_fields_type(fields):
             raise ValueError("'fields' must be a sequence or set of strings")
-        fields = set(v)
-        supported_fields = constants.FIELDS | constants.SERVICE_FIELDS
-        if not fields.issubset(supported_fields):
-            logger.warning("%s field set is not a subset of supported field set %s",
-                           fields, supported_fields)
-        return ','.join(fields | constants.SERVICE_FIELDS)
-
-    @validator('lang', pre=True)
-    def lang_validator(cls, v):
-        if not isinstance(v, str):
+        _check_fields(fields)
+        query['fields'] = _fields_param(fields)
+
+    lang = ip.get('lang')
+    if lang is not None:
+        if not isinstance(lang, str):
             raise ValueError("'lang' must be a string")
-        if v not in constants.LANGS:
-            logger.warning("'%s' lang is not in supported language set: %s",
-                           v, constants.LANGS)
-        return v
+        _check_lang(lang)
+        query['lang'] = lang
+
+    return query
 
 
 class IpApiClient:
@@ -96,7 +128,10 @@ class IpApiClient:
     :param key: The API key for pro unlimited access
     :param session: Existing aiohttp.ClientSession istance
     :param retry_attempts: The number of attempts of fetch result from the service
-    :param retry_delay: The delay in seconds between retry attempts
+    :param retry_delay: The initial delay in seconds between retry attempts
+    :param concurrency: The maximum number of batch requests in flight
+    :param warmup: Open a connection to the service in background when entering the client context
+    :param config: The service configuration, the global config is used by default
 
     """
 
@@ -108,9 +143,12 @@ class IpApiClient:
                  session: Optional[aiohttp.ClientSession] = None,
                  retry_attempts: Optional[int] = None,
                  retry_delay: Optional[float] = None,
+                 concurrency: Optional[int] = None,
+                 warmup: Optional[bool] = None,
+                 config: Optional[Config] = None,
                  ) -> None:
 
-        if fields and not isinstance(fields, (abc.Sequence, abc.Set)):
+        if fields and not _is_fields_type(fields):
             raise TypeError("'fields' argument must be a sequence or set")
         if lang and not isinstance(lang, str):
             raise TypeError("'lang' argument must be a string")
@@ -118,16 +156,32 @@ class IpApiClient:
             raise TypeError("'key' argument must be a string")
         if session and not isinstance(session, aiohttp.ClientSession):
             raise TypeError(f"'session' argument must be an instance of {aiohttp.ClientSession}")
+        if config and not isinstance(config, Config):
+            raise TypeError(f"'config' argument must be an instance of {Config}")
 
+        _check_fields_lang(fields, lang)
+
+        if config is None:
+            config = default_config
         if retry_attempts is None:
             retry_attempts = config.retry_attempts
         if retry_delay is None:
             retry_delay = config.retry_delay
+        if concurrency is None:
+            concurrency = config.concurrency
+        if warmup is None:
+            warmup = config.warmup
+
+        if retry_attempts < 1:
+            raise ValueError("'retry_attempts' argument must be greater than or equal to 1")
+        if concurrency < 1:
+            raise ValueError("'concurrency' argument must be greater than or equal to 1")
 
         if session:
             own_session = False
+            new_session = False
         else:
-            session = aiohttp.ClientSession()
+            session, new_session = acquire_session(config)
             own_session = True
 
         self._session: Optional[aiohttp.ClientSession] = session
@@ -135,21 +189,35 @@ class IpApiClient:
 
         self._base_url = yarl.URL(config.base_url)
         self._pro_url = yarl.URL(config.pro_url)
+        self._json_endpoint = config.json_endpoint
+        self._batch_endpoint = config.batch_endpoint
+        self._batch_size = config.batch_size
+        self._ttl_hold = config.ttl_hold
+
+        # The endpoint URLs with the client fields and lang, they are built on the first use
+        self._client_urls: Dict[str, yarl.URL] = {}
 
-        self._fields = fields
+        self._fields_param = _fields_param(fields) if fields else None
         self._lang = lang
         self._key = key
 
-        self._json_rl = config.json_rate_limit
-        self._json_ttl = 0
-        self._batch_rl = config.batch_rate_limit
-        self._batch_ttl = 0
+        self._json_bucket = TokenBucket(config.json_rate_limit)
+        self._batch_bucket = TokenBucket(config.batch_rate_limit)
+        self._batch_rl_window = RateLimitWindow()
 
         self._retry_attempts = retry_attempts
         self._retry_delay = retry_delay
+        self._retry_max_delay = config.retry_max_delay
+        self._concurrency = concurrency
+        self._batch_semaphore: Optional[asyncio.Semaphore] = None
+
+        # The connection of the already used shared session is warm
+        self._warmup = warmup and new_session
+        self._warmup_task: Optional[asyncio.Future] = None
 
     def __del__(self):
-        if not self._own_session or self.closed:
+        # The attributes are not set if the arguments validation is failed
+        if not getattr(self, '_own_session', False) or self.closed:
             return
 
         message = 'Unclosed client session'
@@ -170,6 +238,8 @@ class IpApiClient:
         pass  # pragma: no cover
 
     async def __aenter__(self) -> 'IpApiClient':
+        if self._warmup and not self.closed and self._warmup_task is None:
+            self._warmup_task = asyncio.ensure_future(self._warmup_connection())
         return self
 
     async def __aexit__(self,
@@ -185,13 +255,35 @@ class IpApiClient:
         return self._session is None
 
     async def close(self):
-        """Close client and own session
+        """Close client and release the shared session
         """
 
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            await asyncio.wait([self._warmup_task])
+            self._warmup_task = None
+
         if self._own_session and not self.closed:
-            await self._session.close()
+            await release_session(self._session)
         self._session = None
 
+    async def _warmup_connection(self):
+        # Resolve DNS and establish the connection (with TLS handshake for pro service)
+        # in advance, the connection is kept in the connector pool for the first request
+        url = self._pro_url if self._key else self._base_url
+
+        try:
+            async with self._session.head(url, allow_redirects=False) as resp:
+                await resp.read()  # the connection is returned to the pool only after the response is read
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logger.debug("Connection warmup has failed: %r", err)
+
+    async def _wait_warmup(self):
+        # The request waits for the pending warmup to reuse its connection instead of opening another one,
+        # the warmup task is not cancelled if the request is cancelled
+        if self._warmup_task is not None and not self._warmup_task.done():
+            await asyncio.wait([self._warmup_task])
+
     async def location(self,
                        ip: Optional[Union[_IPType, _IPsType]] = None,
                        *,
@@ -212,34 +304,32 @@ class IpApiClient:
             raise ValueError('The client session is already closed')
 
         batch = False
-        endpoint = None
 
-        if not ip:
-            endpoint = config.json_endpoint
-        elif isinstance(ip, (str, IPv4Address, IPv6Address)):
-            endpoint = f'{config.json_endpoint}/{ip}'
-        elif isinstance(ip, (abc.Iterable, abc.AsyncIterable)):
+        if not ip or isinstance(ip, _SCALAR_IP_TYPES):
+            pass
+        elif _is_iterable(ip):
             batch = True
         else:
             raise TypeError(f"'ip' argument has an invalid type: {type(ip)}")
 
-        if fields and not isinstance(fields, (abc.Sequence, abc.Set)):
+        if fields and not _is_fields_type(fields):
             raise TypeError("'fields' argument must be a sequence or set")
         if lang and not isinstance(lang, str):
             raise TypeError("'lang' argument must be a string")
 
-        if batch:
-            return await aioitertools.list(self.location_stream(
-                ips=ip,
-                fields=fields,
-                lang=lang,
-                timeout=timeout
-            ))
+        _check_fields_lang(fields, lang)
 
-        fields = fields or self._fields
-        lang = lang or self._lang
+        if batch:
+            results = []
+            async for batch_results in self.location_stream(
+                    ips=ip, fields=fields, lang=lang, timeout=timeout, yield_batches=True):
+                results.extend(batch_results)
+            return results
 
-        url = self._make_url(endpoint, fields, lang)
+        url = self._endpoint_url(self._json_endpoint, fields, lang)
+        if ip:
+            # The IP URL is derived from the cached endpoint URL with its already parsed query
+            url = url.with_path(f'{url.path}/{ip}').with_query(url.query)
 
         return await self._fetch_result(self._fetch_json, url, timeout)
 
@@ -248,8 +338,9 @@ class IpApiClient:
                               *,
                               fields: _FieldsType = None,
                               lang: Optional[str] = None,
-                              timeout: _TimeoutType = aiohttp.helpers.sentinel
-                              ) -> AsyncIterable[Dict[str, Any]]:
+                              timeout: _TimeoutType = aiohttp.helpers.sentinel,
+                              yield_batches: bool = False,
+                              ) -> AsyncIterable[Union[Dict[str, Any], List[Dict[str, Any]]]]:
         """Returns async generator for locating IPs from iterable or async iterable
 
         The method always uses batch API: https://ip-api.com/docs/api:batch
@@ -260,73 +351,135 @@ class IpApiClient:
         :param fields: The sequence or set of returned fields in the result
         :param lang: The language of the result
         :param timeout: The timeout of the whole request to API
-        :return: async generator of results for every IP
+        :param yield_batches: If True, the lists of results for every batch are yielded
+        :return: async generator of results for every IP or lists of results for every batch
         """
 
         if self.closed:
             raise ValueError('The client session is already closed')
 
-        if not isinstance(ips, (abc.Iterable, abc.AsyncIterable)):
+        if not _is_iterable(ips):
             raise TypeError("'ips' argument must be an iterable or async iterable")
-        if fields and not isinstance(fields, (abc.Sequence, abc.Set)):
+        if fields and not _is_fields_type(fields):
             raise TypeError("'fields' argument must be a sequence or set")
         if lang and not isinstance(lang, str):
             raise TypeError("'lang' argument must be a string")
 
-        fields = fields or self._fields
-        lang = lang or self._lang
+        _check_fields_lang(fields, lang)
 
-        url = self._make_url(config.batch_endpoint, fields, lang)
+        url = self._endpoint_url(self._batch_endpoint, fields, lang)
+        batches = self._fetch_batches(url, ips, timeout)
 
-        async for ips_batch in chunker(ips, chunk_size=config.batch_size):
-            results = await self._fetch_result(self._fetch_batch, url, ips_batch, timeout)
-            async for result in aioitertools.iter(results):
-                yield result
+        try:
+            async for results in batches:
+                if yield_batches:
+                    yield results
+                else:
+                    for result in results:
+                        yield result
+        finally:
+            await batches.aclose()
 
-    def _make_url(self, endpoint, fields, lang) -> str:
-        if self._key:
-            url = self._pro_url / endpoint
-            url %= {'key': self._key}
-        else:
-            url = self._base_url / endpoint
+    async def _fetch_batches(self, url, ips, timeout):
+        pending = collections.deque()
+
+        try:
+            async for ips_batch in chunker(ips, chunk_size=self._batch_size):
+                # The results are yielded in the order of batches
+                ready = []
+                while len(pending) >= self._batch_concurrency():
+                    ready.append(await pending.popleft())
+
+                # The next batch is requested before yielding the ready results,
+                # so the request overlaps with processing the results by the caller
+                pending.append(asyncio.ensure_future(
+                    self._fetch_result(self._fetch_batch, url, ips_batch, timeout)))
+
+                for results in ready:
+                    yield results
+
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                if not task.cancel() and not task.cancelled():
+                    task.exception()  # retrieve the exception to avoid "never retrieved" warning
+
+    def _batch_concurrency(self) -> int:
+        concurrency = self._concurrency
+        if not self._key:
+            # Do not send more batches than the service allows for the current window
+            remaining = self._batch_rl_window.remaining()
+            if remaining is not None:
+                concurrency = max(1, min(concurrency, remaining))
+        return concurrency
+
+    def _endpoint_url(self, endpoint, fields, lang) -> yarl.URL:
+        if fields or lang:
+            fields = _fields_param(fields) if fields else self._fields_param
+            return self._make_url(endpoint, fields, lang or self._lang)
+
+        url = self._client_urls.get(endpoint)
+        if url is None:
+            url = self._client_urls[endpoint] = self._make_url(endpoint, self._fields_param, self._lang)
+        return url
+
+    def _make_url(self, endpoint, fields, lang) -> yarl.URL:
+        base_url = self._pro_url if self._key else self._base_url
+        return self._build_url(base_url, endpoint, fields, lang, self._key)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _build_url(base_url, endpoint, fields, lang, key) -> yarl.URL:
+        url = base_url / endpoint
+        query = {}
 
+        if key:
+            query['key'] = key
         if fields:
-            fields = set(fields) | constants.SERVICE_FIELDS
-            url %= {'fields': ','.join(fields)}
+            query['fields'] = fields
         if lang:
-            url %= {'lang': lang}
+            query['lang'] = lang
 
+        if query:
+            # The endpoint URL has no query, so it is set at once without merging
+            url = url.with_query(query)
         return url
 
-    async def _wait_for_rate_limit(self, rl, ttl):
-        if self._key:
-            return
-        if rl == 0:
-            ttl += config.ttl_hold
-            logger.warning("API rate limit is reached. Waiting for %d seconds by rate limit...", ttl)
-            await asyncio.sleep(ttl)
-
     @staticmethod
     def _get_rl_ttl(headers):
-        if 'X-Rl' not in headers or 'X-Ttl' not in headers:
+        rl = headers.get('X-Rl')
+        ttl = headers.get('X-Ttl')
+
+        if rl is None or ttl is None:
+            return None, None
+        return int(rl), int(ttl)
+
+    def _update_rate_limit(self, api, bucket, headers):
+        rl, ttl = self._get_rl_ttl(headers)
+        if rl is None:
             return None, None
 
-        rl = int(headers['X-Rl'])
-        ttl = int(headers['X-Ttl'])
+        logger.debug("%s API rate limit: rl=%d, ttl=%d", api, rl, ttl)
+
+        if rl == 0 and ttl > 0:
+            # The hold is not needed if the limit window is already reset
+            ttl += self._ttl_hold
+            logger.warning("API rate limit is reached. Waiting for %d seconds by rate limit...", ttl)
+        bucket.update(rl, ttl)
 
         return rl, ttl
 
     def _check_http_status(self, resp):
-        rl, ttl = self._get_rl_ttl(resp.headers)
         status = resp.status
 
         if status == HTTPStatus.OK:
-            return True, rl, ttl
+            return
         elif status == HTTPStatus.TOO_MANY_REQUESTS:
             if self._key:
                 raise TooManyRequests(
                     f"(HTTP {status}) Too many requests with using API key", status=status)
-            return False, rl, ttl
+            raise _RateLimited(f"(HTTP {status}) API rate limit is reached")
         elif status == HTTPStatus.UNPROCESSABLE_ENTITY:
             raise TooLargeBatchSize(
                 f"(HTTP {status}) Batch size is too large", status=status)
@@ -338,67 +491,79 @@ class IpApiClient:
                 f"HTTP {status} error occurred", status=status)
 
     async def _fetch_json(self, url, timeout):
-        await self._wait_for_rate_limit(self._json_rl, self._json_ttl)
+        if not self._key:
+            await self._json_bucket.acquire()
+        await self._wait_warmup()
 
         async with self._session.get(url, timeout=timeout) as resp:
-            is_ok, self._json_rl, self._json_ttl = self._check_http_status(resp)
             if not self._key:
-                logger.debug("JSON API rate limit: rl=%d, ttl=%d", self._json_rl, self._json_ttl)
-            if is_ok:
-                return await resp.json()
-            logger.debug("JSON API rate limit is reached")
-            return None
+                self._update_rate_limit('JSON', self._json_bucket, resp.headers)
+            if resp.status != HTTPStatus.OK:
+                # Read the error response to release the connection back to the pool instead of closing it
+                await resp.read()
+                self._check_http_status(resp)
+            return json_loads(await resp.read())
 
     async def _fetch_batch(self, url, ips_batch, timeout):
-        ips_batch = list(ips_batch)
+        queries = []
 
-        for i, ip in enumerate(ips_batch):
+        for ip in ips_batch:
             try:
-                if isinstance(ip, abc.Mapping):
-                    ips_batch[i] = _QueryInfo(**ip).dict(by_alias=True, exclude_none=True)
-                else:
-                    _IpAddr(v=ip)
-            except ValidationError as err:
+                queries.append(_validate_query(ip))
+            except ValueError as err:
                 raise ValueError(f"Invalid query {ip}: {err}") from err
 
-        await self._wait_for_rate_limit(self._batch_rl, self._batch_ttl)
+        # Serialize the batch to bytes once, regardless of the session json serializer
+        body = json_dumpb(queries)
 
-        async with self._session.post(url, json=ips_batch, timeout=timeout) as resp:
-            is_ok, self._batch_rl, self._batch_ttl = self._check_http_status(resp)
+        if self._batch_semaphore is None:
+            # The semaphore is created in the running loop, it is bound to the loop on creation in Python < 3.10
+            self._batch_semaphore = asyncio.Semaphore(self._concurrency)
+
+        # The number of batch requests in flight is limited for all streams of the client
+        async with self._batch_semaphore:
             if not self._key:
-                logger.debug("BATCH API rate limit: rl=%d, ttl=%d", self._batch_rl, self._batch_ttl)
-            if is_ok:
-                return await resp.json()
-            logger.debug("BATCH API rate limit is reached")
-            return None
+                await self._batch_bucket.acquire()
+            await self._wait_warmup()
 
-    async def _fetch_result(self, fetch_coro, *coro_args):
-        retrying = tenacity.AsyncRetrying(
-            reraise=True,
-            retry=tenacity.retry_if_exception_type(ClientError),
-            stop=tenacity.stop_after_attempt(self._retry_attempts),
-            wait=tenacity.wait_fixed(self._retry_delay),
-            after=tenacity.after_log(logger, logging.DEBUG),
-        )
+            async with self._session.post(url, data=body, headers=_JSON_HEADERS, timeout=timeout) as resp:
+                if not self._key:
+                    rl, ttl = self._update_rate_limit('BATCH', self._batch_bucket, resp.headers)
+                    if rl is not None:
+                        self._batch_rl_window.add(rl, ttl)
+                if resp.status != HTTPStatus.OK:
+                    # Read the error response to release the connection back to the pool instead of closing it
+                    await resp.read()
+                    self._check_http_status(resp)
 
-        try:
-            async for attempt in retrying:
-                with attempt:
-                    attempt_number = attempt.retry_state.attempt_number
-                    attempt.retry_state.fn = fetch_coro
-
-                    try:
-                        while True:  # retrying loop when "too many requests" without API key
-                            result = await fetch_coro(*coro_args)
-                            if result:
-                                return result
-                    except aiohttp.ClientError as err:
-                        message = f"Client error: {repr(err)}"
-                        logger.error("(attempt %d/%d) %s", attempt_number, self._retry_attempts, message)
-                        raise ClientError(f"Client error: {repr(err)}") from err
-        except ClientError as err:
-            logger.critical("Client has failed after %d attempts: %s", attempt_number, err)
-            raise
+                return json_loads(await resp.read())
+
+    async def _fetch_result(self, fetch_coro, *coro_args):
+        # The plain loop does not allocate the retrying machinery for every request
+        for attempt_number in range(1, self._retry_attempts + 1):
+            try:
+                return await fetch_coro(*coro_args)
+            except _RateLimited as err:
+                logger.warning("(attempt %d/%d) %s", attempt_number, self._retry_attempts, err)
+                error = err
+            except aiohttp.ClientError as err:
+                message = f"Client error: {repr(err)}"
+                logger.error("(attempt %d/%d) %s", attempt_number, self._retry_attempts, message)
+                error = ClientError(message)
+                error.__cause__ = err
+
+            if attempt_number < self._retry_attempts:
+                # Exponential backoff with jitter desynchronizes the retries of concurrent requests
+                delay = min(self._retry_max_delay, self._retry_delay * 2 ** (attempt_number - 1))
+                delay *= 0.5 + random.random()
+                logger.debug("Retrying %s in %.1f seconds", fetch_coro.__name__, delay)
+                await asyncio.sleep(delay)
+
+        logger.critical("Client has failed after %d attempts: %s", self._retry_attempts, error)
+        if isinstance(error, _RateLimited):
+            # The free API rate limit is still reached after all attempts
+            raise TooManyRequests(str(error), status=HTTPStatus.TOO_MANY_REQUESTS) from error
+        raise error
 
 
 async def location(ip: Optional[Union[_IPType, _IPsType]] = None,
@@ -410,6 +575,8 @@ async def location(ip: Optional[Union[_IPType, _IPsType]] = None,
                    timeout: _TimeoutType = aiohttp.helpers.sentinel,
                    retry_attempts: Optional[int] = None,
                    retry_delay: Optional[float] = None,
+                   concurrency: Optional[int] = None,
+                   config: Optional[Config] = None,
                    ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
     """Locate IP/domain or batch of IPs
 
@@ -424,7 +591,9 @@ async def location(ip: Optional[Union[_IPType, _IPsType]] = None,
     :param session: Existing aiohttp.ClientSession istance
     :param timeout: The timeout of the whole request to the service
     :param retry_attempts: The number of attempts of fetch result from the service
-    :param retry_delay: The delay in seconds between retry attempts
+    :param retry_delay: The initial delay in seconds between retry attempts
+    :param concurrency: The maximum number of batch requests in flight
+    :param config: The service configuration, the global config is used by default
     :return: The dict with result for None/IP/domain or the list of dictionaries for IPs
 
     """
@@ -435,7 +604,10 @@ async def location(ip: Optional[Union[_IPType, _IPsType]] = None,
         key=key,
         session=session,
         retry_attempts=retry_attempts,
-        retry_delay=retry_delay
+        retry_delay=retry_delay,
+        concurrency=concurrency,
+        warmup=False,
+        config=config,
     ) as client:
         return await client.location(ip, timeout=timeout)
 
@@ -448,8 +620,11 @@ async def location_stream(ips: _IPsType,
                           session: Optional[aiohttp.ClientSession] = None,
                           timeout: _TimeoutType = aiohttp.helpers.sentinel,
                           retry_attempts: Optional[int] = None,
-                          retry_delay: Optional[float] = None
-                          ) -> AsyncIterable[Dict[str, Any]]:
+                          retry_delay: Optional[float] = None,
+                          concurrency: Optional[int] = None,
+                          yield_batches: bool = False,
+                          config: Optional[Config] = None,
+                          ) -> AsyncIterable[Union[Dict[str, Any], List[Dict[str, Any]]]]:
     """Returns async generator for locating IPs from iterable or async iterable
 
     The shortcut function to get geo-location of batch of IPs in streaming manner.
@@ -463,7 +638,10 @@ async def location_stream(ips: _IPsType,
     :param session: Existing aiohttp.ClientSession istance
     :param timeout: The timeout of the whole request to the service
     :param retry_attempts: The number of attempts of fetch result from the service
-    :param retry_delay: The delay in seconds between retry attempts
+    :param retry_delay: The initial delay in seconds between retry attempts
+    :param concurrency: The maximum number of batch requests in flight
+    :param yield_batches: If True, the lists of results for every batch are yielded
+    :param config: The service configuration, the global config is used by default
     :return: Async generator for locating IPs
 
     """
@@ -474,7 +652,10 @@ async def location_stream(ips: _IPsType,
         key=key,
         session=session,
         retry_attempts=retry_attempts,
-        retry_delay=retry_delay
+        retry_delay=retry_delay,
+        concurrency=concurrency,
+        warmup=False,
+        config=config,
     ) as client:
-        async for result in client.location_stream(ips, timeout=timeout):
+        async for result in client.location_stream(ips, timeout=timeout, yield_batches=yield_batches):
             yield result
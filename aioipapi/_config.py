@@ -19,7 +19,14 @@ class Config(BaseModel):
     batch_rate_limit: conint(strict=True, ge=1) = 15
     retry_attempts: conint(strict=True, ge=1) = 3
     retry_delay: confloat(strict=True, ge=0.0) = 1.0
+    retry_max_delay: confloat(strict=True, ge=0.0) = 30.0
     ttl_hold: confloat(strict=True, ge=0.0) = 3.0
+    concurrency: conint(strict=True, ge=1) = 1
+    warmup: bool = True
+    connection_limit: conint(strict=True, ge=1) = 30
+    connection_limit_per_host: conint(strict=True, ge=1) = 15
+    keepalive_timeout: confloat(strict=True, ge=0.0) = 75.0
+    dns_cache_ttl: conint(strict=True, ge=0) = 300
 
 
 config = Config()
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 
-FIELDS = {
+FIELDS = frozenset({
     'continent',
     'continentCode',
     'country',
@@ -24,21 +24,21 @@ FIELDS = {
     'mobile',
     'proxy',
     'hosting',
-}
+})
 
-SERVICE_FIELDS = {
+SERVICE_FIELDS = frozenset({
     'status',
     'message',
     'query',
-}
+})
 
-LANGS = {
+LANGS = frozenset({
     'en',
     'de',
     'es',
-    'pt-BP',
+    'pt-BR',
     'fr',
     'ja',
     'zh-CN',
     'ru',
-}
+})
@@ -8,6 +8,11 @@ class ClientError(IpApiError):
     pass
 
 
+class _RateLimited(ClientError):
+    """Free API rate limit is reached, the request should be retried after waiting
+    """
+
+
 class HttpError(IpApiError):
     def __init__(self, *args: object, status: int) -> None:
         super().__init__(*args)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Token bucket rate limiter
+
+    The bucket is refilled continuously with `capacity` tokens per `period` seconds,
+    so the requests are spread over the rate limit window instead of bursting
+    until the service responds that the limit is reached. If the service responds that
+    the limit is reached, the bucket is held until the limit window reset.
+
+    :param capacity: The maximum number of tokens (requests) per period
+    :param period: The period in seconds
+    """
+
+    def __init__(self, capacity: int, period: float = 60.0) -> None:
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+
+        # The release event is created in the running loop when the bucket is held,
+        # because asyncio primitives are bound to the current loop on creation in Python < 3.10
+        self._release_event: Optional[asyncio.Event] = None
+        self._release_time = None
+        self._release_handle = None
+
+    @property
+    def rate(self) -> float:
+        """Returns the refill rate in tokens per second
+        """
+        return self.capacity / self.period
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self) -> None:
+        """Waits for a token and takes it
+
+        The tokens are checked and taken without awaiting in between, so no lock is needed.
+        The waiters sleep until the next token and recheck the tokens after the bucket update.
+        While the bucket is held, all waiters wait for the release event.
+        """
+
+        while True:
+            if self._release_event is not None:
+                await self._release_event.wait()
+                continue
+
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update(self, rl: int, ttl: float) -> None:
+        """Recalibrates the bucket by the rate limit state reported by the service
+
+        :param rl: The number of remaining requests in the current limit window
+        :param ttl: The number of seconds until the limit window reset
+        """
+
+        self._refill()
+        # The service reports the remaining requests after the current one
+        if rl + 1 > self.capacity:
+            self.capacity = rl + 1
+
+        if rl == 0 and ttl > 0:
+            # No tokens until the limit window reset
+            self.tokens = 0.0
+            self._hold(ttl)
+        elif rl == 0:
+            # The limit window is already reset
+            self.tokens = max(self.tokens, 1.0)
+        else:
+            self.tokens = min(self.tokens, rl)
+
+    def _hold(self, ttl: float) -> None:
+        loop = asyncio.get_event_loop()
+        release_time = loop.time() + ttl
+
+        if self._release_handle is not None:
+            if self._release_time >= release_time:
+                return
+            self._release_handle.cancel()
+        else:
+            self._release_event = asyncio.Event()
+
+        self._release_time = release_time
+        self._release_handle = loop.call_later(ttl, self._release)
+
+    def _release(self) -> None:
+        # One token is available at the limit window reset, the next ones are refilled by the rate
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+
+        release_event = self._release_event
+        self._release_event = None
+        self._release_time = None
+        self._release_handle = None
+        release_event.set()
+
+
+class RateLimitWindow:
+    """Sliding window of the rate limit samples reported by the service
+
+    Every sample is `X-Rl` (remaining requests) and `X-Ttl` (seconds until the limit window reset)
+    values. The samples of the expired limit windows are evicted. The responses of concurrent requests
+    may be received out of order, so the remaining requests are estimated as the minimum over the window.
+    """
+
+    def __init__(self) -> None:
+        self._samples = collections.deque()
+
+    def add(self, rl: int, ttl: int) -> None:
+        """Adds a new sample
+        """
+        self._samples.append((time.monotonic() + ttl, rl))
+
+    def remaining(self) -> Optional[int]:
+        """Returns the estimated number of remaining requests or None if it is unknown
+        """
+
+        now = time.monotonic()
+        samples = self._samples
+
+        while samples and samples[0][0] <= now:
+            samples.popleft()
+
+        return min((rl for reset_time, rl in samples if reset_time > now), default=None)
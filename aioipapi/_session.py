@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import weakref
+from typing import Dict, Tuple
+
+import aiohttp
+
+from aioipapi._config import Config
+from aioipapi._utils import json_dumps
+
+
+class _SharedSession:
+    def __init__(self, session: aiohttp.ClientSession) -> None:
+        self.session = session
+        self.refs = 0
+
+
+# The shared sessions for every event loop, a session can be used only in the loop in which it was created
+_shared_sessions: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, _SharedSession]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def _connector_key(config: Config) -> Tuple:
+    return (
+        config.connection_limit,
+        config.connection_limit_per_host,
+        config.dns_cache_ttl,
+        config.keepalive_timeout,
+    )
+
+
+def acquire_session(config: Config) -> Tuple[aiohttp.ClientSession, bool]:
+    """Returns the shared session for the current event loop and the connector config
+
+    The session and its connection pool are shared by all clients without an external session,
+    so the connections are reused across the client instances.
+
+    :param config: The config with the connector parameters
+    :return: The session and the flag which is True if the session has been created
+    """
+
+    loop = asyncio.get_event_loop()
+    sessions = _shared_sessions.setdefault(loop, {})
+    key = _connector_key(config)
+    shared = sessions.get(key)
+    created = False
+
+    if shared is None or shared.session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config.connection_limit,
+            limit_per_host=config.connection_limit_per_host,
+            ttl_dns_cache=config.dns_cache_ttl,
+            keepalive_timeout=config.keepalive_timeout,
+            enable_cleanup_closed=True,
+        )
+        session = aiohttp.ClientSession(connector=connector, json_serialize=json_dumps)
+        shared = sessions[key] = _SharedSession(session)
+        created = True
+
+    shared.refs += 1
+    return shared.session, created
+
+
+async def release_session(session: aiohttp.ClientSession) -> None:
+    """Releases the shared session and closes it when it is released by all clients
+
+    :param session: The session returned by `acquire_session`
+    """
+
+    sessions = _shared_sessions.get(asyncio.get_event_loop(), {})
+
+    for key, shared in sessions.items():
+        if shared.session is not session:
+            continue
+
+        shared.refs -= 1
+        if shared.refs <= 0:
+            del sessions[key]
+            await session.close()
+        return
+
+    # The session is not shared anymore
+    if not session.closed:
+        await session.close()
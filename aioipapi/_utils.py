@@ -1,19 +1,56 @@
 # -*- coding: utf-8 -*-
 
-import operator
+import itertools
+import json
 
-import aioitertools
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def json_dumps(obj) -> str:
+        """Serializes an object to JSON string using orjson
+        """
+        return orjson.dumps(obj).decode()
+
+    json_dumpb = orjson.dumps
+    json_loads = orjson.loads
+else:
+    def json_dumpb(obj) -> bytes:
+        """Serializes an object to JSON bytes
+        """
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    json_dumps = json.dumps
+    json_loads = json.loads
 
 
 async def chunker(iterable, chunk_size: int):
     """Asynchronous chunks generator
     """
 
-    aiterable = aioitertools.enumerate(iterable)
-    args = [aiterable] * chunk_size
+    if isinstance(iterable, (list, tuple)):
+        for i in range(0, len(iterable), chunk_size):
+            yield iterable[i:i + chunk_size]
+        return
 
-    async for chunk in aioitertools.zip_longest(*args, fillvalue=None):
-        chunk = tuple(filter(None, chunk))
-        if chunk:
-            chunk = tuple([v for _, v in sorted(chunk, key=operator.itemgetter(0))])
+    if not hasattr(iterable, '__aiter__'):
+        # Fast path for sync iterables without per-item async iteration
+        iterator = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                return
             yield chunk
+
+    chunk = []
+
+    async for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
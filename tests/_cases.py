@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from ipaddress import IPv4Address
+
+
+# The fields are sent sorted by the client, so the requests do not depend on the set iteration order
+LOCATION_CASES = (
+    (None, None, None, {'status': 'success', 'message': 'test_json', 'query': '127.0.0.1'}),
+    ('localhost', None, None, {'status': 'success', 'message': 'test_json_query', 'query': 'localhost'}),
+    (None, ('lat', 'lon'), 'ru',
+     {'status': 'success', 'message': 'test_json', 'query': '127.0.0.1', 'lang': 'ru', 'lat': 'test', 'lon': 'test'}),
+    ('192.168.0.1', {'country', 'isp'}, None,
+     {'status': 'success', 'message': 'test_json_query', 'query': '192.168.0.1', 'country': 'test', 'isp': 'test'}),
+    (['192.168.0.1', '192.168.0.2'], None, None,
+     [{'status': 'success', 'message': 'test_batch', 'query': '192.168.0.1'},
+      {'status': 'success', 'message': 'test_batch', 'query': '192.168.0.2'}]),
+    ([IPv4Address('192.168.0.1')], None, None,
+     [{'status': 'success', 'message': 'test_batch', 'query': '192.168.0.1'}]),
+    ([{'query': '192.168.0.1', 'fields': ('lon',)}, '192.168.0.2', {'query': '192.168.0.3', 'lang': 'ru'}],
+     ('lat',), 'de',
+     [{'status': 'success', 'message': 'test_batch', 'query': '192.168.0.1', 'lon': 'test', 'lang': 'de'},
+      {'status': 'success', 'message': 'test_batch', 'query': '192.168.0.2', 'lat': 'test', 'lang': 'de'},
+      {'status': 'success', 'message': 'test_batch', 'query': '192.168.0.3', 'lat': 'test', 'lang': 'ru'}]),
+)
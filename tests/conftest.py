@@ -1,95 +1,330 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import collections
+import functools
+import socket
 
 import pytest
+import aiohttp
+import yarl
 from aiohttp.test_utils import TestServer
 from aiohttp import web
 
-from aioipapi import config as ipapi_config
+from aioipapi import IpApiClient, Config, config as ipapi_config
+from aioipapi._utils import json_dumpb, json_loads
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
 
 
 @pytest.fixture(scope='session')
 def event_loop():
-    loop = asyncio.get_event_loop()
+    # uvloop has less overhead per I/O callback than the default loop
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
     yield loop
     loop.close()
 
 
+@functools.lru_cache(maxsize=32)
+def split_fields(fields: str) -> tuple:
+    return tuple(fields.split(','))
+
+
 def update_data(data, request_query):
-    if 'fields' in request_query:
-        fields = request_query['fields'].split(',')
-        for field in fields:
-            data[field] = 'test'
-    if 'lang' in request_query:
-        data['lang'] = request_query['lang']
+    fields = request_query.get('fields')
+    if fields:
+        data.update(dict.fromkeys(split_fields(fields), 'test'))
+    lang = request_query.get('lang')
+    if lang:
+        data['lang'] = lang
+
+
+def json_response(data) -> web.Response:
+    return web.Response(body=json_dumpb(data), content_type='application/json')
+
+
+# The serialized JSON responses by the query and the request parameters
+RESPONSE_CACHE = {}
 
 
 async def get_json(request):
-    data = {}
-    update_data(data, request.query)
-    data.update({'status': 'success', 'message': 'test_json', 'query': '127.0.0.1'})
+    key = ('127.0.0.1', tuple(sorted(request.query.items())))
+    body = RESPONSE_CACHE.get(key)
+
+    if body is None:
+        data = {}
+        update_data(data, request.query)
+        data.update({'status': 'success', 'message': 'test_json', 'query': '127.0.0.1'})
+        body = RESPONSE_CACHE[key] = json_dumpb(data)
 
-    return web.json_response(data=data)
+    return web.Response(body=body, content_type='application/json')
 
 
 async def get_json_query(request):
-    data = {}
-    update_data(data, request.query)
     query = request.match_info['query']
-    data.update({'status': 'success', 'message': 'test_json_query', 'query': query})
+    key = (query, tuple(sorted(request.query.items())))
+    body = RESPONSE_CACHE.get(key)
+
+    if body is None:
+        data = {}
+        update_data(data, request.query)
+        data.update({'status': 'success', 'message': 'test_json_query', 'query': query})
+        body = RESPONSE_CACHE[key] = json_dumpb(data)
+
+    return web.Response(body=body, content_type='application/json')
 
-    return web.json_response(data=data)
+
+BATCH_DATA = {'status': 'success', 'message': 'test_batch'}
+
+
+@functools.lru_cache(maxsize=1024)
+def batch_item_data(query, fields, lang):
+    # The results are cached, so the same queries in the batches are computed once
+    item_data = {}
+    update_data(item_data, {'fields': fields, 'lang': lang})
+    return {**item_data, **BATCH_DATA, 'query': query}
 
 
 async def post_batch(request):
-    data = []
-    json_data = await request.json()
+    json_data = json_loads(await request.read())
+
+    fields = request.query.get('fields')
+    lang = request.query.get('lang')
+
+    # The items are not changed, the item fields and lang override the request query
+    data = [
+        batch_item_data(item, fields, lang) if isinstance(item, str) else
+        batch_item_data(item['query'], item.get('fields', fields), item.get('lang', lang))
+        for item in json_data
+    ]
+    return json_response(data)
+
+
+MOCK_BASE_URL = 'http://ip-api.mock/'
+
+
+def make_config(base_url: str, **kwargs) -> Config:
+    # The config is a copy, so the global config is not changed for the tests with the real service
+    return Config(**{**ipapi_config.dict(), 'base_url': base_url, **kwargs})
 
-    for item in json_data:
-        item_data = {}
 
-        if isinstance(item, str):
-            query = item
-            update_data(item_data, request.query)
+def make_mock_config() -> Config:
+    # The mock service has no rate limits
+    return make_config(MOCK_BASE_URL, json_rate_limit=10000, batch_rate_limit=10000)
+
+
+class MockRequest:
+    """The request for the mock handlers without HTTP
+    """
+
+    def __init__(self, url: yarl.URL, match_info: dict, body: bytes):
+        self.query = url.query
+        self.match_info = match_info
+        self._body = body
+
+    async def read(self) -> bytes:
+        return self._body
+
+
+class MockResponse:
+    """The response context manager which calls the mock handlers directly
+    """
+
+    # The handlers are deterministic, so the responses are cached by the request
+    cache = {}
+
+    def __init__(self, method: str, url, data: bytes = None):
+        self.method = method
+        self.url = yarl.URL(url)
+        self.data = data
+        self.status = None
+        self.headers = None
+        self._body = None
+
+    async def __aenter__(self):
+        key = (self.method, self.url, self.data)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.cache[key] = await self._handle()
+
+        self.status = response.status
+        self.headers = response.headers
+        self._body = response.body
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def _handle(self) -> web.Response:
+        path = self.url.path
+        match_info = {}
+
+        if self.method == 'GET' and path == '/json':
+            handler = get_json
+        elif self.method == 'GET' and path.startswith('/json/'):
+            handler = get_json_query
+            match_info['query'] = path[len('/json/'):]
+        elif self.method == 'POST' and path == '/batch':
+            handler = post_batch
         else:
-            query = item['query']
-            if 'fields' not in item and 'fields' in request.query:
-                item['fields'] = request.query['fields']
-            if 'lang' not in item and 'lang' in request.query:
-                item['lang'] = request.query['lang']
-            update_data(item_data, item)
+            return web.Response(status=404)
+
+        return await handler(MockRequest(self.url, match_info, self.data))
+
+    async def read(self) -> bytes:
+        return self._body
+
+
+@pytest.fixture
+def mock_aiohttp(monkeypatch):
+    """Returns the config for the mock service, the requests are handled without HTTP
+    """
+
+    monkeypatch.setattr(aiohttp.ClientSession, 'get', lambda self, url, **kwargs: MockResponse('GET', url))
+    monkeypatch.setattr(aiohttp.ClientSession, 'post',
+                        lambda self, url, *, data=None, **kwargs: MockResponse('POST', url, data))
 
-        item_data.update({'status': 'success', 'message': 'test_batch', 'query': query})
-        data.append(item_data)
+    return make_mock_config()
 
-    return web.json_response(data=data)
+
+class LocalServer:
+    """The local server address and the connector factory to connect to it
+    """
+
+    def __init__(self, base_url: str, make_connector):
+        self.base_url = base_url
+        self.make_connector = make_connector
 
 
 @pytest.fixture(scope='session')
-async def ipapi_server():
+async def ipapi_server(tmp_path_factory):
     app = web.Application()
 
     app.router.add_get('/json', get_json)
     app.router.add_get('/json/{query}', get_json_query)
     app.router.add_post('/batch', post_batch)
 
-    server = TestServer(app)
+    if hasattr(socket, 'AF_UNIX'):
+        # Unix socket bypasses TCP stack of the loopback interface, the host in URL is ignored by the connector
+        runner = web.AppRunner(app)
+        await runner.setup()
+        path = str(tmp_path_factory.mktemp('ipapi') / 'ipapi.sock')
+        await web.UnixSite(runner, path).start()
+        server = LocalServer('http://ip-api.local/', functools.partial(aiohttp.UnixConnector, path=path))
+        close = runner.cleanup
+    else:  # pragma: no cover
+        test_server = TestServer(app)
+        await test_server.start_server()
+        server = LocalServer(str(test_server.make_url('')), aiohttp.TCPConnector)
+        close = test_server.close
+
+    # Warm up the server routing and response path before the tests
+    async with aiohttp.ClientSession(connector=server.make_connector()) as session:
+        async with session.get(yarl.URL(server.base_url) / 'json') as resp:
+            await resp.read()
+
+    yield server
+    await close()
+
+
+class RecordingServer:
+    """The local TCP server address and the records of the requests
+
+    The records are tuples `(method, path, peername)`, the peername identifies the client connection.
+    The queued responses are sent instead of the handler responses in the order of the requests.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.requests = []
+        self.responses = collections.deque()
+
+    def connections(self) -> set:
+        return {peername for _, _, peername in self.requests}
+
+
+@pytest.fixture
+async def recording_server():
+    server = None
+
+    @web.middleware
+    async def record(request, handler):
+        server.requests.append((request.method, request.path, request.transport.get_extra_info('peername')))
+        if server.responses:
+            return server.responses.popleft()
+        return await handler(request)
+
+    app = web.Application(middlewares=[record])
+
+    app.router.add_get('/json', get_json)
+    app.router.add_get('/json/{query}', get_json_query)
+    app.router.add_post('/batch', post_batch)
+
+    # TCP server, so the client own session connects to it and the connections are distinguished by peername
+    test_server = TestServer(app)
+    await test_server.start_server()
+    server = RecordingServer(str(test_server.make_url('/')))
 
-    await server.start_server()
     yield server
-    await server.close()
+    await test_server.close()
+
+
+@pytest.fixture(scope='session')
+def config_local(ipapi_server):
+    return make_config(ipapi_server.base_url)
 
 
 @pytest.fixture
-async def config_local(ipapi_server):
-    base_url = ipapi_config.base_url
-    ipapi_config.base_url = str(ipapi_server.make_url(''))
-    yield ipapi_config
-    ipapi_config.base_url = base_url
+def global_config_local(config_local, monkeypatch):
+    """Points the global config to the local server for the duration of a test
+    """
+    monkeypatch.setattr(ipapi_config, 'base_url', config_local.base_url)
+    return ipapi_config
+
+
+@pytest.fixture(scope='session')
+async def local_session(ipapi_server):
+    async with aiohttp.ClientSession(connector=ipapi_server.make_connector()) as session:
+        yield session
+
+
+@pytest.fixture(scope='session')
+async def shared_connector():
+    connector = aiohttp.TCPConnector(limit=50, ttl_dns_cache=300)
+    yield connector
+    await connector.close()
+
+
+@pytest.fixture(scope='session')
+async def client_session(shared_connector):
+    async with aiohttp.ClientSession(connector=shared_connector, connector_owner=False) as session:
+        yield session
+
+
+@pytest.fixture(scope='session')
+async def ipapi_client(client_session):
+    """The client for the real service shared by the tests
+    """
+    async with IpApiClient(session=client_session) as client:
+        yield client
+
+
+@pytest.fixture(scope='session')
+async def mock_client(client_session):
+    """The client for the mock service shared by the tests, the tests must use `mock_aiohttp` fixture
+    """
+    async with IpApiClient(session=client_session, config=make_mock_config()) as client:
+        yield client
 
 
 def pytest_addoption(parser):
+    # The real service tests are I/O bound, they can be run in parallel with pytest-xdist:
+    # pytest -n 6 --run-real-tests -m real_service
+    # Every worker has its own session-scoped fixtures, including the client and its connection pool.
     parser.addoption(
         "--run-real-tests", action="store_true", default=False,
         help="run tests with requests to ip-api.com service"
@@ -99,11 +334,7 @@ def pytest_addoption(parser):
 def pytest_configure(config):
     config.addinivalue_line("markers", "real_service: mark test as real")
 
-
-def pytest_collection_modifyitems(config, items):
-    if config.getoption("--run-real-tests"):
-        return
-    skip_real_tests = pytest.mark.skip(reason="need --run-real-tests option to run")
-    for item in items:
-        if "real_service" in item.keywords:
-            item.add_marker(skip_real_tests)
+    if not config.getoption("--run-real-tests"):
+        # The tests with the real service are deselected by the pytest mark expression
+        markexpr = config.option.markexpr
+        config.option.markexpr = f'({markexpr}) and not real_service' if markexpr else 'not real_service'
@@ -1,10 +1,33 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import logging
+
 import pytest
 import aiohttp
 import aioitertools
+from aiohttp import web
+
+from aioipapi import IpApiClient, Config, ClientError, HttpError, TooManyRequests, location, location_stream
+from aioipapi._ratelimit import TokenBucket, RateLimitWindow
+from aioipapi._utils import chunker
+
+from _cases import LOCATION_CASES
+from conftest import make_config
+
 
-from aioipapi import IpApiClient
+def assert_subset(expected, actual):
+    """Checks that the result or the list of results contains the expected fields and values
+    """
+
+    if isinstance(expected, list):
+        assert isinstance(actual, list) and len(actual) == len(expected)
+        for expected_item, actual_item in zip(expected, actual):
+            assert_subset(expected_item, actual_item)
+        return
+
+    for key, value in expected.items():
+        assert actual[key] == value
 
 
 @pytest.mark.asyncio
@@ -40,41 +63,216 @@ async def test_client_unclosed():
         assert len(record) == 0
 
 
+@pytest.mark.asyncio
+async def test_client_shared_session():
+    config = Config(connection_limit=7)
+
+    client1 = IpApiClient(config=config)
+    client2 = IpApiClient(config=config)
+    session = client1._session
+    assert client2._session is session
+
+    await client1.close()
+    assert not session.closed
+    await client2.close()
+    assert session.closed
+
+    async with IpApiClient(config=config) as client:
+        assert client._session is not session
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('warmup, methods', [
+    (True, ['HEAD', 'GET', 'POST']),
+    (False, ['GET', 'POST']),
+])
+async def test_client_warmup(warmup, methods, recording_server):
+    # The separate connector config, so the client creates a new shared session which is warmed up
+    config = make_config(recording_server.base_url, keepalive_timeout=60.0)
+
+    async with IpApiClient(warmup=warmup, config=config) as client:
+        await client.location('192.168.0.1')
+        await client.location(['192.168.0.1', '192.168.0.2'])
+
+    # The first request waits for the warmup and reuses its connection
+    assert [method for method, _, _ in recording_server.requests] == methods
+    assert len(recording_server.connections()) == 1
+
+
+def rate_limit_response(status, rl, ttl, data=None):
+    headers = {'X-Rl': str(rl), 'X-Ttl': str(ttl)}
+    if data is None:
+        return web.Response(status=status, headers=headers)
+    return web.json_response(data, status=status, headers=headers)
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_then_success(recording_server, caplog):
+    caplog.set_level(logging.DEBUG, logger='aioipapi')
+    config = make_config(recording_server.base_url, retry_delay=0.0, ttl_hold=0.0)
+    recording_server.responses.extend([
+        rate_limit_response(429, 0, 1),
+        rate_limit_response(200, 44, 60, {'status': 'success', 'query': '1.1.1.1'}),
+    ])
+
+    async with IpApiClient(warmup=False, config=config) as client:
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        res = await client.location('1.1.1.1')
+        elapsed = loop.time() - start
+
+    assert res == {'status': 'success', 'query': '1.1.1.1'}
+    assert len(recording_server.requests) == 2
+    # The retry waits for the bucket hold by X-Rl/X-Ttl headers of the rate limited response
+    assert elapsed >= 0.9
+    assert 'JSON API rate limit: rl=0, ttl=1' in caplog.text
+    assert 'JSON API rate limit: rl=44, ttl=60' in caplog.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', ['1.1.1.1', ['1.1.1.1', '8.8.8.8']])
+async def test_rate_limited_always(query, recording_server):
+    config = make_config(recording_server.base_url, retry_attempts=2, retry_delay=0.0, ttl_hold=0.0)
+    recording_server.responses.extend(rate_limit_response(429, 0, 0) for _ in range(2))
+
+    async with IpApiClient(warmup=False, config=config) as client:
+        with pytest.raises(TooManyRequests) as exc_info:
+            await client.location(query)
+
+    assert exc_info.value.status == 429
+    assert len(recording_server.requests) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('status', [404, 500])
+@pytest.mark.parametrize('query', ['1.1.1.1', ['1.1.1.1', '8.8.8.8']])
+async def test_error_response_keeps_connection(status, query, recording_server):
+    config = make_config(recording_server.base_url)
+    # The body is large enough not to be received with the headers
+    recording_server.responses.append(web.Response(status=status, body=b'error details' * 100000))
+
+    async with IpApiClient(warmup=False, config=config) as client:
+        with pytest.raises(HttpError) as exc_info:
+            await client.location(query)
+        assert exc_info.value.status == status
+        await client.location(query)
+
+    # The error response is read, so the connection is returned to the pool and reused
+    assert len(recording_server.requests) == 2
+    assert len(recording_server.connections()) == 1
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize('query', [
     {'query': '1.1.1.1', 'fields': ['lon', 'lat'], 'lang': 'ru', 'extra': 'spam'},
     {'query': '1.1.1.1.1'},
     {'query': '1.1.1.1', 'fields': 'foo'},
     {'query': '1.1.1.1', 'lang': 1},
+    {'query': '1.1.1.1', 'fields': ['lon', 'spam']},
+    {'query': '1.1.1.1', 'lang': 'rus'},
     {'fields': ['lon', 'lat'], 'lang': 'ru'},
 ])
-async def test_validate_batch_input_data(query):
-    async with IpApiClient() as client:
+async def test_validate_batch_input_data(query, client_session):
+    async with IpApiClient(session=client_session) as client:
         with pytest.raises(ValueError):
             await client.location([query])
 
 
 @pytest.mark.asyncio
-@pytest.mark.parametrize('query, fields, lang, expected', [
-    (None, None, None, {'status': 'success', 'message': 'test_json', 'query': '127.0.0.1'}),
-    ('localhost', None, None, {'status': 'success', 'message': 'test_json_query', 'query': 'localhost'}),
-    (None, {'lat', 'lon'}, 'ru',
-     {'status': 'success', 'message': 'test_json', 'query': '127.0.0.1', 'lang': 'ru', 'lat': 'test', 'lon': 'test'}),
-    ('192.168.0.1', ['isp', 'country'], None,
-     {'status': 'success', 'message': 'test_json_query', 'query': '192.168.0.1', 'country': 'test', 'isp': 'test'}),
-    (['192.168.0.1', '192.168.0.2'], None, None,
-     [{'status': 'success', 'message': 'test_batch', 'query': '192.168.0.1'},
-      {'status': 'success', 'message': 'test_batch', 'query': '192.168.0.2'}]),
-    ([{'query': '192.168.0.1', 'fields': {'lon'}}, '192.168.0.2', {'query': '192.168.0.3', 'lang': 'ru'}],
-     ['lat'], 'de',
-     [{'status': 'success', 'message': 'test_batch', 'query': '192.168.0.1', 'lon': 'test', 'lang': 'de'},
-      {'status': 'success', 'message': 'test_batch', 'query': '192.168.0.2', 'lat': 'test', 'lang': 'de'},
-      {'status': 'success', 'message': 'test_batch', 'query': '192.168.0.3', 'lat': 'test', 'lang': 'ru'}]),
+@pytest.mark.parametrize('fields, lang', [
+    (['lon', 'spam'], None),
+    (None, 'rus'),
 ])
-async def test_location_local_mock(query, fields, lang, expected, config_local):
-    async with IpApiClient(fields=fields, lang=lang) as client:
-        res = await client.location(query)
-        assert res == expected
+async def test_validate_fields_lang(fields, lang, client_session):
+    with pytest.raises(ValueError):
+        IpApiClient(fields=fields, lang=lang, session=client_session)
+
+    async with IpApiClient(session=client_session) as client:
+        with pytest.raises(ValueError):
+            await client.location('1.1.1.1', fields=fields, lang=lang)
+        with pytest.raises(ValueError):
+            await client.location_stream(['1.1.1.1'], fields=fields, lang=lang).__anext__()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query, fields, lang, expected', LOCATION_CASES)
+@pytest.mark.parametrize('client_options', [False, True], ids=['call', 'client'])
+async def test_location_local_mock(query, fields, lang, expected, client_options,
+                                   mock_aiohttp, mock_client, client_session):
+    if client_options:
+        # The client fields and lang are used by the cached endpoint URLs
+        async with IpApiClient(fields=fields, lang=lang, session=client_session, config=mock_aiohttp) as client:
+            res = await client.location(query)
+    else:
+        res = await mock_client.location(query, fields=fields, lang=lang)
+    assert_subset(expected, res)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('concurrency', [1, 3])
+async def test_location_stream_local_mock(concurrency, config_local, local_session):
+    ips = [f'192.168.{i // 256}.{i % 256}' for i in range(250)]
+
+    async with IpApiClient(concurrency=concurrency, session=local_session, config=config_local) as client:
+        results = [res async for res in client.location_stream(ips)]
+
+    assert [res['query'] for res in results] == ips
+
+    async with IpApiClient(concurrency=concurrency, session=local_session, config=config_local) as client:
+        batches = [batch async for batch in client.location_stream(ips, yield_batches=True)]
+
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    assert [res['query'] for batch in batches for res in batch] == ips
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('lang', [None, 'ru'])
+async def test_location_url_key_escaping(lang, client_session, monkeypatch):
+    key = 'a+b&c=d%2F ключ'
+    urls = []
+
+    async def fetch_result(fetch_coro, url, timeout):
+        urls.append(url)
+
+    async with IpApiClient(key=key, session=client_session) as client:
+        monkeypatch.setattr(client, '_fetch_result', fetch_result)
+        await client.location('8.8.8.8', lang=lang)
+
+    url, = urls
+    assert url.path == '/json/8.8.8.8'
+    assert url.query['key'] == key
+    assert 'key=a%2Bb%26c%3Dd%252F+%D0%BA%D0%BB%D1%8E%D1%87' in str(url)
+
+
+@pytest.mark.asyncio
+async def test_location_a_lot_queries_local_mock(mock_aiohttp, mock_client):
+    # The identical batches are handled once by the mock service and then served from its response cache
+    ips = ['8.8.8.8'] * 2000
+
+    results = [res async for res in mock_client.location_stream(ips)]
+
+    assert len(results) == len(ips)
+    assert all(res['query'] == '8.8.8.8' for res in results)
+
+
+@pytest.mark.asyncio
+async def test_location_functions_global_config(global_config_local, local_session):
+    res = await location('192.168.0.1', session=local_session)
+    assert res['query'] == '192.168.0.1'
+
+    results = [res async for res in location_stream(['192.168.0.1', '192.168.0.2'], session=local_session)]
+    assert [res['query'] for res in results] == ['192.168.0.1', '192.168.0.2']
+
+
+@pytest.mark.asyncio
+async def test_client_config(config_local, local_session):
+    config = Config(base_url=config_local.base_url, batch_size=10)
+    ips = [f'192.168.0.{i}' for i in range(25)]
+
+    async with IpApiClient(session=local_session, config=config) as client:
+        batches = [batch async for batch in client.location_stream(ips, yield_batches=True)]
+
+    assert [len(batch) for batch in batches] == [10, 10, 5]
 
 
 sentinel = object()
@@ -90,42 +288,39 @@ sentinel = object()
     '8.8.8.8',
     ['1.0.0.1', '1.1.1.1', '8.8.4.4'],
 ])
-async def test_location(query):
+async def test_location(query, ipapi_client):
     fields = ['org', 'lat', 'lon', 'country', 'as']
 
-    async with IpApiClient(fields=fields) as client:
-        if query is sentinel:
-            result = await client.location()
-        else:
-            result = await client.location(query)
+    if query is sentinel:
+        result = await ipapi_client.location(fields=fields)
+    else:
+        result = await ipapi_client.location(query, fields=fields)
 
-        if isinstance(result, dict):
-            result = [result]
+    if isinstance(result, dict):
+        result = [result]
 
-        for res in result:
-            assert 'status' in res and res['status'] == 'success'
-            assert 'query' in res
+    for res in result:
+        assert 'status' in res and res['status'] == 'success'
+        assert 'query' in res
 
-            for field in fields:
-                assert field in res
+        for field in fields:
+            assert field in res
 
 
 @pytest.mark.real_service
 @pytest.mark.asyncio
-async def test_location_reserved_range():
-    async with IpApiClient() as client:
-        res = await client.location('127.0.0.1')
-        assert 'status' in res and res['status'] == 'fail'
-        assert 'message' in res and res['message'] == 'reserved range'
+async def test_location_reserved_range(ipapi_client):
+    res = await ipapi_client.location('127.0.0.1')
+    assert 'status' in res and res['status'] == 'fail'
+    assert 'message' in res and res['message'] == 'reserved range'
 
 
 @pytest.mark.real_service
 @pytest.mark.asyncio
-async def test_location_invalid_query():
-    async with IpApiClient() as client:
-        res = await client.location('1.2.3.4.5')
-        assert 'status' in res and res['status'] == 'fail'
-        assert 'message' in res and res['message'] == 'invalid query'
+async def test_location_invalid_query(ipapi_client):
+    res = await ipapi_client.location('1.2.3.4.5')
+    assert 'status' in res and res['status'] == 'fail'
+    assert 'message' in res and res['message'] == 'invalid query'
 
 
 @pytest.mark.real_service
@@ -141,3 +336,92 @@ async def test_location_a_lot_queries():
 
             for field in check_fields:
                 assert field in res
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    bucket = TokenBucket(2, period=0.1)
+
+    await bucket.acquire()
+    await bucket.acquire()
+    assert bucket.tokens < 1
+
+    await bucket.acquire()
+    assert bucket.tokens < 1
+
+    bucket.update(5, 60)
+    assert bucket.capacity == 6
+    assert bucket.tokens < 1
+
+    loop = asyncio.get_event_loop()
+
+    # The limit window is already reset, a token is available at once
+    bucket.update(0, 0)
+    start_time = loop.time()
+    await bucket.acquire()
+    assert loop.time() - start_time < 0.01
+
+    bucket.update(0, 0.2)
+    start_time = loop.time()
+    await asyncio.gather(bucket.acquire(), bucket.acquire())
+    assert loop.time() - start_time > 0.19
+
+
+def test_token_bucket_other_loop():
+    # The bucket is created outside of the loop in which it is used
+    bucket = TokenBucket(1, period=0.1)
+
+    async def acquire():
+        await bucket.acquire()
+        bucket.update(0, 0.01)
+        await bucket.acquire()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(acquire())
+    finally:
+        loop.close()
+
+
+def test_rate_limit_window():
+    window = RateLimitWindow()
+    assert window.remaining() is None
+
+    window.add(10, 60)
+    window.add(12, 60)
+    assert window.remaining() == 10
+
+    window.add(0, 0)
+    assert window.remaining() == 10
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('iterable, expected', [
+    (list(range(7)), [[0, 1, 2], [3, 4, 5], [6]]),
+    (tuple(range(7)), [[0, 1, 2], [3, 4, 5], [6]]),
+    (iter(range(7)), [[0, 1, 2], [3, 4, 5], [6]]),
+    (aioitertools.iter(range(7)), [[0, 1, 2], [3, 4, 5], [6]]),
+    (aioitertools.iter([0, {}, None, '']), [[0, {}, None], ['']]),
+])
+async def test_chunker(iterable, expected):
+    assert [list(chunk) async for chunk in chunker(iterable, chunk_size=3)] == expected
+
+
+@pytest.mark.asyncio
+async def test_retry_attempts(caplog):
+    config = Config(base_url='http://127.0.0.1:1/', retry_attempts=2, retry_delay=0.0, warmup=False)
+
+    async with IpApiClient(config=config) as client:
+        with pytest.raises(ClientError):
+            await client.location('1.1.1.1')
+
+    assert len([r for r in caplog.records if r.message.startswith('(attempt')]) == 2
+
+    with pytest.raises(ValueError):
+        IpApiClient(retry_attempts=0)
+
+
+@pytest.mark.parametrize('concurrency', [0, -1])
+def test_invalid_concurrency(concurrency):
+    with pytest.raises(ValueError):
+        IpApiClient(concurrency=concurrency)